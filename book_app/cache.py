@@ -0,0 +1,82 @@
+import os
+import threading
+
+from collections import OrderedDict
+
+LIST_CACHE_SIZE = int(os.getenv('LIST_CACHE_SIZE', '1024'))
+LIST_CACHE_MAX_ROWS = int(os.getenv('LIST_CACHE_MAX_ROWS', '100'))
+
+
+class ListingCache:
+    """LRU cache of query results, invalidated through versioned scopes.
+
+    A result is stored with the versions of the scopes it depends on, taken
+    before the query runs. A write bumps the scopes it touches, so any result
+    read before the write no longer matches and is never served again, while
+    results of untouched scopes stay valid.
+
+    Results longer than `max_rows` are not cached, so memory is bounded by
+    `maxsize` x `max_rows` rows. Scope versions are kept in a bounded LRU as
+    well. Versions of forgotten scopes fall back to the highest version
+    forgotten so far, which can only invalidate more entries, never revive a
+    stale one.
+    """
+
+    def __init__(self, maxsize: int = LIST_CACHE_SIZE, max_rows: int = LIST_CACHE_MAX_ROWS):
+        self.maxsize = maxsize
+        self.max_rows = max_rows
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._versions = OrderedDict()
+        self._floor = 0
+        self._clock = 0
+        self._lock = threading.Lock()
+
+    def _version(self, scope) -> int:
+        return self._versions.get(scope, self._floor)
+
+    def versions(self, scopes: list) -> tuple:
+        with self._lock:
+            return tuple(self._version(scope) for scope in scopes)
+
+    def get(self, key, scopes: list):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == tuple(self._version(scope) for scope in scopes):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def set(self, key, versions: tuple, value: list):
+        if self.maxsize <= 0 or len(value) > self.max_rows:
+            return
+        with self._lock:
+            self._entries[key] = (versions, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def bump(self, scopes: list):
+        with self._lock:
+            self._clock += 1
+            for scope in scopes:
+                self._versions[scope] = self._clock
+                self._versions.move_to_end(scope)
+            while len(self._versions) > self.maxsize:
+                _, version = self._versions.popitem(last=False)
+                self._floor = max(self._floor, version)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+            }
@@ -1,8 +1,9 @@
 from datetime import datetime
-from sqlalchemy import and_
+from sqlalchemy import and_, func, select
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
-from . import auth, models, schemas
+from . import auth, cache, models, schemas
 
 
 class RecordExistedException(Exception):
@@ -15,34 +16,94 @@ class RecordNotFoundException(Exception):
 
 recordNotFound = RecordNotFoundException("Record not found")
 
+listing_cache = cache.ListingCache()
+
+
+def listing_scopes(author: str = None, publish_date=None) -> list:
+    scopes = []
+    if author is not None:
+        scopes.append(('author', author))
+    if publish_date is not None:
+        scopes.append(('publish_date', publish_date))
+    return scopes or [('all',)]
+
+
+def invalidate_listings(*books):
+    scopes = [('all',)]
+    for book in books:
+        scopes += [('author', book.author), ('publish_date', book.publish_date)]
+    listing_cache.bump(scopes)
+
+
+def author_id_of(name: str):
+    return select(models.Author.id).where(models.Author.name == name).scalar_subquery()
+
+
+def get_or_create_author(db: Session, name: str) -> models.Author:
+    """Call before changing any other record, an integrity error is taken for a concurrent insert of the author."""
+    author = db.query(models.Author).filter(models.Author.name == name).first()
+    if author:
+        return author
+    # errors of pending changes must not reach the except below
+    db.flush()
+    try:
+        with db.begin_nested():
+            author = models.Author(name=name, created_at=datetime.now())
+            db.add(author)
+    except IntegrityError:
+        # created by a concurrent request in the meantime
+        author = db.query(models.Author).filter(models.Author.name == name).one()
+    return author
+
+
+def list_authors(db: Session, after: str = None, limit: int = 100):
+    book_count = func.count(models.Book.id).label('book_count')
+    query = db.query(models.Author.id, models.Author.name, book_count) \
+        .join(models.Book, and_(models.Book.author_id == models.Author.id, models.Book.is_deleted == False))
+    if after is not None:
+        query = query.filter(models.Author.name > after)
+    query = query.group_by(models.Author.id, models.Author.name).order_by(models.Author.name)
+    return query.limit(limit).all()
+
 
 def get_book(db: Session, book_id: int):
     return db.query(models.Book).filter(models.Book.id == book_id, models.Book.is_deleted == False).first()
 
 
-def list_books(db: Session, page: int = 1, limit: int = 100, filter: dict = {}):
+def list_books(db: Session, page: int = 1, limit: int = 100, filter: dict = {}) -> list[schemas.BookDetail]:
+    author = filter.get('author')
+    author = author.strip() if author is not None else None
+    publish_date = filter.get('publish_date')
+    scopes = listing_scopes(author, publish_date)
+    key = (page, limit, author, publish_date)
+    books = listing_cache.get(key, scopes)
+    if books is not None:
+        return list(books)
+    versions = listing_cache.versions(scopes)
+
     offset = (page-1) * limit
     query = db.query(models.Book).filter(models.Book.is_deleted == False)
-    for k, v in filter.items():
-        if v is None:
-            continue
-        if k == 'publish_date':
-            query = query.filter(models.Book.publish_date == v)
-        if k == 'author':
-            query = query.filter(models.Book.author == v.strip())
+    if publish_date is not None:
+        query = query.filter(models.Book.publish_date == publish_date)
+    if author is not None:
+        query = query.filter(models.Book.author_id == author_id_of(author))
 
     query = query.order_by(models.Book.id.desc())
-    return query.offset(offset).limit(limit).all()
+    books = [schemas.BookDetail.model_validate(b, from_attributes=True)
+             for b in query.offset(offset).limit(limit).all()]
+    listing_cache.set(key, versions, books)
+    return list(books)
 
 
 def create_book(db: Session, book: schemas.BookCreate) -> models.Book:
     existed = db.query(models.Book).filter(models.Book.title == book.title,
-                                           models.Book.author == book.author).first()
+                                           models.Book.author_id == author_id_of(book.author)).first()
     if existed:
         msg = f"Book with title: {book.title}, author: {book.author} existed"
         raise RecordExistedException(msg)
+    author = get_or_create_author(db, book.author)
     db_book = models.Book(title=book.title,
-                          author=book.author,
+                          author_ref=author,
                           publish_date=book.publish_date,
                           isbn=book.isbn,
                           price=book.price,
@@ -51,6 +112,7 @@ def create_book(db: Session, book: schemas.BookCreate) -> models.Book:
     db.add(db_book)
     db.commit()
     db.refresh(db_book)
+    invalidate_listings(db_book)
     return db_book
 
 
@@ -60,12 +122,14 @@ def update_book(db: Session, book_id: int, book: schemas.BookUpdate) -> models.B
         raise recordNotFound
 
     existed = db.query(models.Book).filter(models.Book.title == book.title,
-                                           models.Book.author == book.author).first()
+                                           models.Book.author_id == author_id_of(book.author)).first()
     if existed and existed.id is not book_id:
         msg = f"Cannot update, book with title: {book.title}, author: {book.author} existed"
         raise RecordExistedException(msg)
+    previous = schemas.BookDetail.model_validate(db_book, from_attributes=True)
+    author = get_or_create_author(db, book.author)
     db_book.title = book.title
-    db_book.author = book.author
+    db_book.author_ref = author
     db_book.publish_date = book.publish_date
     db_book.isbn = book.isbn
     db_book.price = book.price
@@ -73,6 +137,7 @@ def update_book(db: Session, book_id: int, book: schemas.BookUpdate) -> models.B
     db.add(db_book)
     db.commit()
     db.refresh(db_book)
+    invalidate_listings(previous, db_book)
     return db_book
 
 
@@ -84,6 +149,7 @@ def delete_book(db: Session, book_id: int):
     db_book.updated_at = datetime.now()
     db.add(db_book)
     db.commit()
+    invalidate_listings(db_book)
 
 
 def create_user(db: Session, user: schemas.UserCreate) -> models.User:
@@ -5,11 +5,17 @@ from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import JWTError
 from sqlalchemy.orm import Session
 
-from . import crud, schemas, auth
-from .database import SessionLocal
+from . import crud, schemas, auth, profiling
+from .database import SessionLocal, engine
 
 
 app = FastAPI()
+if profiling.profiling_enabled():
+    app.router.route_class = profiling.ProfiledRoute
+    app.add_middleware(profiling.ProfilingMiddleware)
+if profiling.slow_query_log_enabled():
+    profiling.install_slow_query_log(engine, float(profiling.SLOW_QUERY_THRESHOLD_MS))
+    app.add_middleware(profiling.RequestScopeMiddleware)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 # Dependency
@@ -63,8 +69,8 @@ async def login(form_data: Annotated[OAuth2PasswordRequestForm, Depends()], db:
 
 
 @app.get("/books", response_model=list[schemas.BookDetail], tags=['book'])
-def list_books(page: int = 1, 
-               limit: int = 100,
+def list_books(page: int = Query(1, ge=1),
+               limit: int = Query(100, ge=1),
                publish_date: Union[date, None] = None,
                author: Union[str, None] = None,
                db: Session = Depends(get_db)):
@@ -76,6 +82,19 @@ def list_books(page: int = 1,
     return books
 
 
+@app.get("/authors", response_model=list[schemas.AuthorDetail], tags=['author'])
+def list_authors(after: Union[str, None] = None,
+                 limit: int = Query(100, ge=1, le=1000),
+                 db: Session = Depends(get_db)):
+    authors = crud.list_authors(db, after=after, limit=limit)
+    return authors
+
+
+@app.get("/cache/stats", response_model=schemas.CacheStats, dependencies=[Depends(require_authorization)], tags=['stats'])
+def cache_stats():
+    return crud.listing_cache.stats()
+
+
 @app.get("/books/{book_id}", response_model=schemas.BookDetail, tags=['book'])
 def get_book(book_id: int, db: Session = Depends(get_db)):
     db_book = crud.get_book(db, book_id)
@@ -1,16 +1,27 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, Date
+from sqlalchemy import Column, ForeignKey, Index, Integer, String, Date
+from sqlalchemy.orm import relationship
 from sqlalchemy.types import Boolean, DECIMAL, TIMESTAMP
 
 from .database import Base
 
 
+class Author(Base):
+    __tablename__ = 'authors'
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(100), nullable=False, unique=True)
+    created_at = Column(TIMESTAMP, default=datetime.now())
+
+
 class Book(Base):
     __tablename__ = 'books'
+    __table_args__ = (Index('books_title_author_idx', 'title', 'author_id', unique=True),)
 
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String(255), nullable=False)
-    author = Column(String(100), nullable=False)
+    author_id = Column(Integer, ForeignKey('authors.id'), nullable=False, index=True)
+    author_ref = relationship(Author, lazy='joined', innerjoin=True)
     publish_date = Column(Date, nullable=False)
     isbn = Column(String(15), nullable=False)
     price = Column(DECIMAL(2), nullable=False)
@@ -18,6 +29,10 @@ class Book(Base):
     created_at = Column(TIMESTAMP, default=datetime.now())
     updated_at = Column(TIMESTAMP, default=datetime.now())
 
+    @property
+    def author(self) -> str:
+        return self.author_ref.name
+
 
 class User(Base):
     __tablename__ = 'users'
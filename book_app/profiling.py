@@ -0,0 +1,245 @@
+import asyncio
+import hmac
+import logging
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import PlainTextResponse
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN')
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', '5'))
+PROFILE_DIR = os.getenv('PROFILE_DIR', tempfile.gettempdir())
+PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', '100'))
+SLOW_QUERY_THRESHOLD_MS = os.getenv('SLOW_QUERY_THRESHOLD_MS')
+
+# (file, function) of the leaf frames of threads waiting for work
+IDLE_FRAMES = {('selectors.py', 'select'), ('threading.py', 'wait'), ('queue.py', 'get')}
+
+logger = logging.getLogger(__name__)
+
+# ASGI scope of the request being served, FastAPI stores the matched route in it
+current_scope: ContextVar[dict] = ContextVar('current_scope', default=None)
+# profiler of the request being served, if it is profiled
+current_profiler: ContextVar['SamplingProfiler'] = ContextVar('current_profiler', default=None)
+
+
+def profiling_enabled() -> bool:
+    return bool(PROFILE_TOKEN) or PROFILE_SAMPLE_RATE > 0
+
+
+def slow_query_log_enabled() -> bool:
+    return SLOW_QUERY_THRESHOLD_MS is not None
+
+
+def route_of(scope: dict) -> str:
+    if scope is None:
+        return '-'
+    route = scope.get('route')
+    path = route.path if route is not None else scope.get('path')
+    return f"{scope.get('method')} {path}"
+
+
+class SamplingProfiler:
+    """Samples the stacks of the threads serving one request at a fixed interval.
+
+    The event loop thread is sampled from the start, threadpool workers are
+    added by `ProfiledRoute` when they run a sync endpoint of the request.
+    Samples of threads idling in a wait are skipped. The result is in collapsed
+    stack format, one `thread;frame;...;frame count` line per distinct stack.
+    """
+
+    def __init__(self, interval_ms: float = PROFILE_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self.samples = Counter()
+        self.threads = {threading.get_ident()}
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frames = sys._current_frames()
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident in list(self.threads):
+                frame = frames.get(ident)
+                if frame is None or (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in IDLE_FRAMES:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def collapsed(self) -> str:
+        return '\n'.join(f"{stack} {count}" for stack, count in self.samples.most_common())
+
+
+class ProfiledRoute(APIRoute):
+    """Route registering the threadpool worker running a sync endpoint with the request's profiler."""
+
+    def __init__(self, path, endpoint, **kwargs):
+        super().__init__(path, endpoint, **kwargs)
+        if asyncio.iscoroutinefunction(self.dependant.call):
+            return
+        call = self.dependant.call
+
+        # swapped after the signature has been analysed, the handler reads it per request
+        def register_thread(*args, **kwargs):
+            profiler = current_profiler.get()
+            if profiler is not None:
+                profiler.threads.add(threading.get_ident())
+            return call(*args, **kwargs)
+
+        self.dependant.call = register_thread
+
+
+def save_profile(scope: dict, profile: str, directory: str = PROFILE_DIR, max_files: int = PROFILE_MAX_FILES) -> str:
+    name = re.sub(r'[^A-Za-z0-9]+', '_', route_of(scope)).strip('_')
+    timestamp = datetime.now().strftime('%Y%m%d%H%M%S%f')
+    path = os.path.join(directory, f"{timestamp}-{name}.collapsed")
+    os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(profile)
+    # names start with the timestamp, drop the oldest profiles over the limit
+    saved = sorted(f for f in os.listdir(directory) if f.endswith('.collapsed'))
+    for old in saved[:-max_files]:
+        try:
+            os.remove(os.path.join(directory, old))
+        except FileNotFoundError:
+            # already removed by a concurrent save
+            pass
+    return path
+
+
+class ProfilingMiddleware:
+    """Profiles requests carrying the privileged header, or a random sample of all requests.
+
+    Other requests are passed straight through. Every profile is saved to
+    `directory`, keeping the latest `max_files`. Requests profiled through the
+    header get the profile back as the response body instead of the endpoint's
+    response, whose status code is kept in the `X-Profile-Status` header.
+    """
+
+    def __init__(self, app, token: str = PROFILE_TOKEN, sample_rate: float = PROFILE_SAMPLE_RATE,
+                 interval_ms: float = PROFILE_INTERVAL_MS, directory: str = PROFILE_DIR,
+                 max_files: int = PROFILE_MAX_FILES):
+        self.app = app
+        self.token = token.encode() if token else None
+        self.sample_rate = sample_rate
+        self.interval_ms = interval_ms
+        self.directory = directory
+        self.max_files = max_files
+        self.header = PROFILE_HEADER.lower().encode()
+
+    def requested(self, scope) -> bool:
+        if not self.token:
+            return False
+        for name, value in scope['headers']:
+            if name == self.header:
+                return hmac.compare_digest(value, self.token)
+        return False
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        requested = self.requested(scope)
+        if not requested and (self.sample_rate <= 0 or random.random() >= self.sample_rate):
+            return await self.app(scope, receive, send)
+
+        messages = []
+
+        async def send_or_keep(message):
+            if requested:
+                messages.append(message)
+            else:
+                await send(message)
+
+        profiler = SamplingProfiler(self.interval_ms)
+        token = current_profiler.set(profiler)
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_or_keep)
+        finally:
+            profiler.stop()
+            current_profiler.reset(token)
+
+        profile = profiler.collapsed()
+        path = await run_in_threadpool(save_profile, scope, profile, self.directory, self.max_files)
+        if not requested:
+            return
+        status = next(m['status'] for m in messages if m['type'] == 'http.response.start')
+        response = PlainTextResponse(profile, headers={
+            'X-Profile-Status': str(status),
+            'X-Profile-File': path,
+        })
+        await response(scope, receive, send)
+
+
+class RequestScopeMiddleware:
+    """Exposes the ASGI scope of the current request through `current_scope`."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        token = current_scope.set(scope)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_scope.reset(token)
+
+
+def parameter_shape(parameters):
+    if isinstance(parameters, dict):
+        return {k: type(v).__name__ for k, v in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [type(v).__name__ for v in parameters]
+    return type(parameters).__name__
+
+
+def install_slow_query_log(engine, threshold_ms: float):
+    """Logs every statement on `engine` taking at least `threshold_ms`.
+
+    Only the types of the bound parameters are logged, never their values.
+    """
+    threshold = threshold_ms / 1000
+
+    # kept on the execution context, which goes away with the statement even when it fails
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context._query_start_time = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._query_start_time
+        if elapsed < threshold:
+            return
+        if executemany:
+            shape = f"{len(parameters)} x {parameter_shape(parameters[0]) if parameters else None}"
+        else:
+            shape = parameter_shape(parameters)
+        logger.warning("slow query %.1fms route=%s params=%s: %s",
+                       elapsed * 1000, route_of(current_scope.get()), shape, statement)
@@ -28,6 +28,23 @@ class BookDetail(BaseBook):
         from_attributes = True
 
 
+class AuthorDetail(BaseModel):
+    id: int
+    name: str
+    book_count: int
+
+    class ConfigDict :
+        from_attributes = True
+
+
+class CacheStats(BaseModel):
+    hits: int
+    misses: int
+    evictions: int
+    size: int
+    maxsize: int
+
+
 class User(BaseModel):
     email: str
 
@@ -1,12 +1,18 @@
+import os
+import pytest
+import time
+
 from datetime import date
+from fastapi import FastAPI
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
 
 from ..database import Base
 from ..main import app, get_db
-from .. import schemas
+from .. import cache, crud, profiling, schemas
 
 SQLALCHEMY_DATABASE_URL = "sqlite://"
 
@@ -330,4 +336,257 @@ def test_delete_book():
 
 
     bookdetail_error = client.get("/books/{id}".format(id=book['id']))
-    assert bookdetail_error.status_code == 404
\ No newline at end of file
+    assert bookdetail_error.status_code == 404
+
+
+def test_profile_request_with_header(tmp_path):
+    """This test case checks whether a request carrying the profiling header gets its profile back and saved to disk.
+    Steps:
+        Mounts the profiling middleware on a small app with a profiling token, keeping one profile on disk.
+        Sends GET requests without the header, with a wrong one and with a non-ASCII one,
+        and asserts that the endpoint response is returned untouched.
+        Sends GET requests with the header and asserts that the profile of the endpoint thread is returned with the original status.
+        Asserts that only the latest profile is kept in the profile directory.
+    """
+    profiled_app = FastAPI()
+    profiled_app.router.route_class = profiling.ProfiledRoute
+    profiled_app.add_middleware(profiling.ProfilingMiddleware, token='secret', sample_rate=0,
+                                interval_ms=1, directory=str(tmp_path), max_files=1)
+
+    @profiled_app.get('/sleep')
+    def sleep():
+        time.sleep(0.05)
+        return {'status': 'ok'}
+
+    profiled_client = TestClient(profiled_app)
+    for headers in ({}, {profiling.PROFILE_HEADER: 'wrong'}, {profiling.PROFILE_HEADER: 'café'.encode('latin-1')}):
+        response = profiled_client.get('/sleep', headers=headers)
+        assert response.status_code == 200
+        assert response.json() == {'status': 'ok'}
+    assert list(tmp_path.iterdir()) == []
+
+    for _ in range(2):
+        response = profiled_client.get('/sleep', headers={profiling.PROFILE_HEADER: 'secret'})
+        assert response.status_code == 200
+        assert response.headers['X-Profile-Status'] == '200'
+        assert 'sleep (test_book_app.py' in response.text
+    assert [p.name for p in tmp_path.iterdir()] == [os.path.basename(response.headers['X-Profile-File'])]
+
+
+def test_slow_query_log(caplog):
+    """This test case checks whether statements over the threshold are logged with their parameter shapes.
+    Steps:
+        Installs the slow query log on a fresh engine with a threshold of 0ms.
+        Executes a statement with bound parameters.
+        Asserts that the statement and the parameter types, but not the values, are logged.
+    """
+    slow_engine = create_engine("sqlite://")
+    profiling.install_slow_query_log(slow_engine, 0)
+    with caplog.at_level('WARNING', logger=profiling.__name__):
+        with slow_engine.connect() as conn:
+            conn.execute(text("select :title, :price"), {"title": "secret title", "price": 10.99})
+            with pytest.raises(OperationalError):
+                conn.execute(text("select * from nope"))
+    assert "select ?, ?" in caplog.text
+    assert "['str', 'float']" in caplog.text
+    assert "secret title" not in caplog.text
+
+
+def test_list_authors():
+    """This test case checks whether the authors endpoint (/authors) lists authors with their book count, page by page.
+    Steps:
+        Authenticates using a valid user's credentials.
+        Creates a book of a new author using a POST request to the /books endpoint.
+        Asserts that the created book still exposes its author name.
+        Sends GET requests to the /books endpoint filtered by author, and to the /authors endpoint.
+        Asserts that the author is listed with the number of its books, and that the next page starts after it.
+    """
+    authresponse = client.post(
+        "/token",
+        data={"username": test_user.email, "password": test_user.password}
+    )
+    authdata = authresponse.json()
+
+    bookresponse = client.post(
+        "/books",
+        json={
+            "title": test_book.title,
+            "author": "Ada Lovelace",
+            "publish_date": test_book.publish_date.isoformat(),
+            "isbn": test_book.isbn,
+            "price": test_book.price
+        },
+        headers={
+            "Authorization": "Bearer {token}".format(token=authdata['access_token']),
+            "Content-Type": "application/json; charset=utf-8"
+        }
+    )
+    assert bookresponse.status_code == 200
+    assert bookresponse.json()['author'] == "Ada Lovelace"
+
+    listresponse = client.get("/books", params={"author": "Ada Lovelace"})
+    assert listresponse.status_code == 200
+    assert [b['author'] for b in listresponse.json()] == ["Ada Lovelace"]
+
+    authorresponse = client.get("/authors", params={"limit": 1})
+    assert authorresponse.status_code == 200
+    authors = authorresponse.json()
+    assert len(authors) == 1
+    assert authors[0]['name'] == "Ada Lovelace"
+    assert authors[0]['book_count'] == 1
+
+    nextresponse = client.get("/authors", params={"after": authors[0]['name']})
+    assert nextresponse.status_code == 200
+    assert [a['name'] for a in nextresponse.json()] == [test_book.author]
+    assert nextresponse.json()[0]['book_count'] == 3
+
+
+
+def test_list_authors_without_books():
+    """This test case checks whether authors without any remaining book are left out of the authors endpoint (/authors).
+    Steps:
+        Authenticates using a valid user's credentials.
+        Creates a book of a new author, then updates it to another new author.
+        Asserts that only the new author is listed.
+        Deletes the book and asserts that neither author is listed.
+    """
+    authresponse = client.post(
+        "/token",
+        data={"username": test_user.email, "password": test_user.password}
+    )
+    headers = {
+        "Authorization": "Bearer {token}".format(token=authresponse.json()['access_token']),
+        "Content-Type": "application/json; charset=utf-8"
+    }
+    book = {
+        "title": "Notes on the Analytical Engine",
+        "author": "Old Author",
+        "publish_date": test_book.publish_date.isoformat(),
+        "isbn": test_book.isbn,
+        "price": test_book.price
+    }
+    bookresponse = client.post("/books", json=book, headers=headers)
+    assert bookresponse.status_code == 200
+    book_id = bookresponse.json()['id']
+
+    updateresponse = client.put("/books/{id}".format(id=book_id), json={**book, "author": "New Author"}, headers=headers)
+    assert updateresponse.status_code == 200
+    names = [a['name'] for a in client.get("/authors").json()]
+    assert "New Author" in names
+    assert "Old Author" not in names
+
+    deleteresponse = client.delete("/books/{id}".format(id=book_id), headers=headers)
+    assert deleteresponse.status_code == 200
+    names = [a['name'] for a in client.get("/authors").json()]
+    assert "New Author" not in names
+    assert "Old Author" not in names
+
+
+def test_update_book_to_new_author():
+    """This test case checks whether a book can take the title of another book of its author when moving to a new author.
+    Steps:
+        Authenticates using a valid user's credentials.
+        Creates two books with different titles by the same author.
+        Updates the second book to the title of the first one and a new author.
+        Asserts that the response status code is 200 and the book has the new title and author.
+        Asserts that the authors endpoint (/authors) rejects limits out of range.
+    """
+    authresponse = client.post(
+        "/token",
+        data={"username": test_user.email, "password": test_user.password}
+    )
+    headers = {
+        "Authorization": "Bearer {token}".format(token=authresponse.json()['access_token']),
+        "Content-Type": "application/json; charset=utf-8"
+    }
+    book = {
+        "title": "Renamed Title 1",
+        "author": "Renaming Author",
+        "publish_date": test_book.publish_date.isoformat(),
+        "isbn": test_book.isbn,
+        "price": test_book.price
+    }
+    assert client.post("/books", json=book, headers=headers).status_code == 200
+    bookresponse = client.post("/books", json={**book, "title": "Renamed Title 2"}, headers=headers)
+    assert bookresponse.status_code == 200
+
+    updateresponse = client.put(
+        "/books/{id}".format(id=bookresponse.json()['id']),
+        json={**book, "author": "Renamed Author"},
+        headers=headers
+    )
+    assert updateresponse.status_code == 200, updateresponse.text
+    assert updateresponse.json()['title'] == "Renamed Title 1"
+    assert updateresponse.json()['author'] == "Renamed Author"
+
+    assert client.get("/authors", params={"limit": -1}).status_code == 422
+    assert client.get("/authors", params={"limit": 1001}).status_code == 422
+
+
+def test_listing_cache():
+    """This test case checks whether the listing cache evicts least recently used entries and only invalidates touched scopes.
+    Steps:
+        Stores results for two authors and an unfiltered listing in a cache of size 3.
+        Bumps the scope of one author and asserts that only its result, and the unfiltered one, are invalidated.
+        Asserts that results longer than the row limit are not stored.
+        Adds entries over the size and asserts that the least recently used one is evicted.
+    """
+    listing = cache.ListingCache(maxsize=3, max_rows=3)
+    for key, scopes in (('a', [('author', 'a')]), ('b', [('author', 'b')]), ('all', [('all',)])):
+        listing.set(key, listing.versions(scopes), [key])
+
+    listing.bump([('all',), ('author', 'a')])
+    assert listing.get('a', [('author', 'a')]) is None
+    assert listing.get('all', [('all',)]) is None
+    assert listing.get('b', [('author', 'b')]) == ['b']
+
+    listing.set('long', listing.versions([('all',)]), ['row'] * 4)
+    assert listing.get('long', [('all',)]) is None
+
+    listing.set('c', listing.versions([('author', 'c')]), ['c'])
+    listing.set('d', listing.versions([('author', 'd')]), ['d'])
+    listing.set('e', listing.versions([('author', 'e')]), ['e'])
+    assert listing.get('b', [('author', 'b')]) is None
+    assert listing.stats() == {'hits': 1, 'misses': 4, 'evictions': 3, 'size': 3, 'maxsize': 3}
+
+
+def test_list_books_cached():
+    """This test case checks whether repeated listings are served from the cache until a book is written.
+    Steps:
+        Sends the same GET request to the /books endpoint twice and asserts that the second one is a cache hit.
+        Deletes a listed book with valid authentication.
+        Sends the GET request again and asserts that the deleted book is no longer listed.
+        Asserts that the cache stats endpoint (/cache/stats) requires authentication and reports the hits.
+        Asserts that listings with a limit under 1 are rejected.
+    """
+    authresponse = client.post(
+        "/token",
+        data={"username": test_user.email, "password": test_user.password}
+    )
+    authdata = authresponse.json()
+
+    first = client.get("/books", params={"author": test_book.author})
+    hits = crud.listing_cache.stats()['hits']
+    second = client.get("/books", params={"author": test_book.author})
+    assert crud.listing_cache.stats()['hits'] == hits + 1
+    assert second.json() == first.json()
+
+    book = first.json()[0]
+    client.delete(
+        "/books/{id}".format(id=book['id']),
+        headers={"Authorization": "Bearer {token}".format(token=authdata['access_token'])}
+    )
+    third = client.get("/books", params={"author": test_book.author})
+    assert third.status_code == 200
+    assert book['id'] not in [b['id'] for b in third.json()]
+    assert crud.listing_cache.stats()['hits'] == hits + 1
+
+    assert client.get("/cache/stats").status_code == 401
+    statsresponse = client.get(
+        "/cache/stats",
+        headers={"Authorization": "Bearer {token}".format(token=authdata['access_token'])}
+    )
+    assert statsresponse.status_code == 200
+    assert statsresponse.json()['hits'] == hits + 1
+
+    assert client.get("/books", params={"limit": 0}).status_code == 422
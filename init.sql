@@ -2,12 +2,19 @@
 -- sequence
 create sequence book_id_seq start 1 increment 1;
 create sequence user_id_seq start 1 increment 1;
+create sequence author_id_seq start 1 increment 1;
 
 -- table
+create table authors (
+    id int primary key default nextval('author_id_seq'),
+    name varchar(100) unique not null,
+    created_at timestamp default CURRENT_TIMESTAMP
+);
+
 create table books (
     id int primary key default nextval('book_id_seq'),
     title varchar(255) not null,
-    author varchar(100) not null,
+    author_id int not null references authors (id),
     publish_date date not null,
     isbn varchar(15) not null,
     price numeric(10, 2) not null,
@@ -15,7 +22,8 @@ create table books (
     created_at timestamp default CURRENT_TIMESTAMP,
     updated_at timestamp
 );
-create unique index books_title_author_idx on books (title, author);
+create unique index books_title_author_idx on books (title, author_id);
+create index books_author_id_idx on books (author_id);
 
 create table users (
     id int primary key default nextval('user_id_seq'),
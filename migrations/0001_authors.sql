@@ -0,0 +1,29 @@
+-- Move author names from books into their own table, referenced by id
+begin;
+
+create sequence author_id_seq start 1 increment 1;
+
+create table authors (
+    id int primary key default nextval('author_id_seq'),
+    name varchar(100) unique not null,
+    created_at timestamp default CURRENT_TIMESTAMP
+);
+
+insert into authors (name)
+select distinct author from books order by author;
+
+alter table books add column author_id int references authors (id);
+
+update books
+set author_id = authors.id
+from authors
+where authors.name = books.author;
+
+alter table books alter column author_id set not null;
+
+drop index books_title_author_idx;
+alter table books drop column author;
+create unique index books_title_author_idx on books (title, author_id);
+create index books_author_id_idx on books (author_id);
+
+commit;